@@ -21,11 +21,10 @@ import adsk.core
 import adsk.fusion
 import traceback
 import os
-import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from .utils import utils
-from .utils.xacro2unity import convert_xacro_to_urdf
 from .core import Link, Joint, Write
 
 # -----------------------------
@@ -34,16 +33,61 @@ from .core import Link, Joint, Write
 _start_marker_index = None
 _start_timeline_count = None
 _need_rollback = False
+_cleanup_done = False
 
 
-def _get_timeline_marker_index(design: adsk.fusion.Design):
+class _ExportCanceled(Exception):
+    """Raised when the user presses Cancel on the progress dialog."""
+
+
+def _report_progress(progress, value, message):
+    """
+    Update the progress dialog, then let Fusion repaint and register a click on
+    Cancel. Raises _ExportCanceled so the normal rollback path runs.
+    """
+    if progress is None:
+        return
+    progress.progressValue = int(value)
+    progress.message = message
+    adsk.doEvents()
+    if progress.wasCancelled:
+        raise _ExportCanceled()
+
+
+class _TimelineView:
+    """
+    Cached access to design.timeline for the rollback helpers.
+
+    Every attribute read on a Fusion object is an API round-trip, so the timeline
+    is fetched once and its item count is only re-read after the view deletes items.
+    tl is None when the design has no timeline (Direct Modeling).
+    """
+
+    def __init__(self, design: adsk.fusion.Design):
+        try:
+            self.tl = design.timeline
+        except:
+            self.tl = None
+        self._count = None
+
+    @property
+    def count(self) -> int:
+        if self._count is None:
+            self._count = int(self.tl.count)
+        return self._count
+
+    def invalidate(self):
+        """Forget the cached count after the timeline was modified."""
+        self._count = None
+
+
+def _get_timeline_marker_index(timeline: _TimelineView):
     """
     Record the current timeline marker position index.
     Fusion exposes markerPosition differently by version, so try multiple approaches.
     """
-    try:
-        tl = design.timeline
-    except:
+    tl = timeline.tl
+    if tl is None:
         return None
 
     # Preferred: markerPosition has an index
@@ -56,12 +100,12 @@ def _get_timeline_marker_index(design: adsk.fusion.Design):
 
     # Fallback: approximate using current timeline end
     try:
-        return int(tl.count)
+        return timeline.count
     except:
         return None
 
 
-def _try_set_timeline_marker(design: adsk.fusion.Design, marker_index: int) -> bool:
+def _try_set_timeline_marker(timeline: _TimelineView, marker_index: int) -> bool:
     """
     Try to move timeline marker to marker_index.
     Returns True if success, False otherwise.
@@ -69,14 +113,13 @@ def _try_set_timeline_marker(design: adsk.fusion.Design, marker_index: int) -> b
     if marker_index is None:
         return False
 
-    try:
-        tl = design.timeline
-    except:
+    tl = timeline.tl
+    if tl is None:
         return False
 
     # Clamp index
     try:
-        count = int(tl.count)
+        count = timeline.count
         if marker_index < 0:
             marker_index = 0
         if marker_index > count:
@@ -101,12 +144,12 @@ def _try_set_timeline_marker(design: adsk.fusion.Design, marker_index: int) -> b
     return False
 
 
-def _move_marker_to_end(design: adsk.fusion.Design):
+def _move_marker_to_end(timeline: _TimelineView):
     """
     Move timeline marker to the end. Needed to ensure timeline items are deletable.
     """
-    tl = design.timeline
-    c = int(tl.count)
+    tl = timeline.tl
+    c = timeline.count
     if c <= 0:
         return
 
@@ -124,55 +167,69 @@ def _move_marker_to_end(design: adsk.fusion.Design):
         pass
 
 
-def _delete_timeline_from_index_strict(design: adsk.fusion.Design, start_count: int):
+def _underlying(tlo):
+    """
+    Yield the deletable objects behind a TimelineObject (entity, then object).
+    """
+    for attr in ('entity', 'object'):
+        try:
+            obj = getattr(tlo, attr, None)
+        except:
+            continue
+        if obj is not None and hasattr(obj, 'deleteMe'):
+            yield obj
+
+
+def _delete_timeline_from_index_strict(timeline: _TimelineView, start_count: int):
     """
     Delete timeline items with index >= start_count.
 
+    The items are first grouped and deleted in a single call; if Fusion refuses to
+    create the group, fall back to deleting them one by one.
+
     In some Fusion builds, timeline.item(i) returns TimelineObject without deleteMe().
     We must delete its underlying entity/object instead.
     """
     if start_count is None:
         return
 
-    tl = design.timeline
-    end_index = int(tl.count) - 1
+    tl = timeline.tl
+    end_index = timeline.count - 1
     if end_index < start_count:
         return
 
-    for i in range(end_index, start_count - 1, -1):
-        tlo = tl.item(i)
-
-        # Try common underlying object access patterns
-        deleted = False
-
-        # 1) entity.deleteMe()
-        try:
-            ent = getattr(tlo, 'entity', None)
-            if ent is not None and hasattr(ent, 'deleteMe'):
-                ent.deleteMe()
-                deleted = True
-        except:
-            pass
-
-        if deleted:
-            continue
-
-        # 2) object.deleteMe()
+    try:
+        # Preferred: wrap the new items in one group and delete it with its contents
+        # (one API round-trip instead of one per item)
         try:
-            obj = getattr(tlo, 'object', None)
-            if obj is not None and hasattr(obj, 'deleteMe'):
-                obj.deleteMe()
-                deleted = True
+            group = tl.timelineGroups.add(start_count, end_index)
+            if group is not None and group.deleteMe(True):
+                return
         except:
             pass
 
-        if deleted:
-            continue
-
-        # 3) If neither is deletable, try to suppress / remove via timeline itself (rare support)
-        # Some builds support deleting by manipulating timeline groups; not always available.
-        # If not possible, we skip.
-        # (You can log here if you want to know which item cannot be deleted.)
+        # Fallback: snapshot the items once, then delete them newest first
+        item = tl.item
+        snapshot = [item(i) for i in range(start_count, end_index + 1)]
+        for tlo in reversed(snapshot):
+            # A group (e.g. the one copy_occs makes) is deleted with its contents
+            group = adsk.fusion.TimelineGroup.cast(tlo)
+            if group is not None:
+                try:
+                    group.deleteMe(True)
+                except:
+                    pass
+                continue
+            # Try the underlying entity first, then the object.
+            # If neither is deletable the item is skipped.
+            for obj in _underlying(tlo):
+                try:
+                    obj.deleteMe()
+                    break
+                except:
+                    pass
+    finally:
+        timeline.invalidate()
 
 
 # -----------------------------
@@ -183,14 +240,16 @@ def run(context):
     app = None
     product = None
     design = None
+    timeline = None
+    progress = None
     root = None
-    components = None
 
     success_msg = 'Successfully create URDF file'
     msg = success_msg
 
-    global _need_rollback, _start_marker_index, _start_timeline_count
+    global _need_rollback, _start_marker_index, _start_timeline_count, _cleanup_done
     _need_rollback = True
+    _cleanup_done = False
     _start_marker_index = None
     _start_timeline_count = None
 
@@ -209,12 +268,12 @@ def run(context):
             return
 
         root = design.rootComponent
-        components = design.allComponents
 
         # Capture "start state" BEFORE any modification
-        _start_marker_index = _get_timeline_marker_index(design)
+        timeline = _TimelineView(design)
+        _start_marker_index = _get_timeline_marker_index(timeline)
         try:
-            _start_timeline_count = int(design.timeline.count)
+            _start_timeline_count = timeline.count
         except:
             _start_timeline_count = None
 
@@ -254,7 +313,9 @@ def run(context):
                 ui.messageBox(msg, title)
             return
 
-        inertial_dict, msg = Link.make_inertial_dict(root, msg)
+        # one snapshot of the top-level occurrences, shared with copy_occs below
+        occurrences = utils.get_occurrences(root)
+        inertial_dict, msg = Link.make_inertial_dict(root, msg, occurrences)
         if msg != success_msg:
             if ui:
                 ui.messageBox(msg, title)
@@ -267,64 +328,121 @@ def run(context):
 
         links_xyz_dict = {}
 
+        # Progress in percent; the STL export gets the largest share
+        progress = ui.createProgressDialog()
+        progress.isCancelButtonShown = True
+        progress.show(title, 'Writing URDF files...', 0, 100, 0)
+
         # --------------------
         # write URDF / xacro / launch
-        Write.write_urdf(joints_dict, links_xyz_dict, inertial_dict, package_name, robot_name, save_dir)
-        Write.write_materials_xacro(joints_dict, links_xyz_dict, inertial_dict, package_name, robot_name, save_dir)
-        Write.write_transmissions_xacro(joints_dict, links_xyz_dict, inertial_dict, package_name, robot_name, save_dir)
-        Write.write_gazebo_xacro(joints_dict, links_xyz_dict, inertial_dict, package_name, robot_name, save_dir)
-        Write.write_display_launch(package_name, robot_name, save_dir)
-        Write.write_gazebo_launch(package_name, robot_name, save_dir)
-        Write.write_control_launch(package_name, robot_name, save_dir, joints_dict)
-        Write.write_yaml(package_name, robot_name, save_dir, joints_dict)
-
-        utils.copy_package(save_dir, package_dir)
+        # Every writer produces its own file and only reads the dictionaries, so the
+        # independent ones and the package template copy run in the background.
+        # write_urdf fills links_xyz_dict for write_transmissions_xacro and both may
+        # show a message box, so those two stay on this thread, in order.
+        with ThreadPoolExecutor() as executor:
+            futures = [
+                executor.submit(utils.copy_package, save_dir, package_dir),
+                executor.submit(Write.write_materials_xacro, joints_dict, links_xyz_dict, inertial_dict, package_name, robot_name, save_dir),
+                executor.submit(Write.write_gazebo_xacro, joints_dict, links_xyz_dict, inertial_dict, package_name, robot_name, save_dir),
+                executor.submit(Write.write_display_launch, package_name, robot_name, save_dir),
+                executor.submit(Write.write_gazebo_launch, package_name, robot_name, save_dir),
+                executor.submit(Write.write_control_launch, package_name, robot_name, save_dir, joints_dict),
+                executor.submit(Write.write_yaml, package_name, robot_name, save_dir, joints_dict),
+            ]
+
+            Write.write_urdf(joints_dict, links_xyz_dict, inertial_dict, package_name, robot_name, save_dir)
+            Write.write_transmissions_xacro(joints_dict, links_xyz_dict, inertial_dict, package_name, robot_name, save_dir)
+
+            for future in futures:
+                future.result()
+
+        # edits the copied template, so it must follow copy_package
         utils.update_cmakelists(save_dir, package_name)
         utils.update_package_xml(save_dir, package_name)
 
         # --------------------
         # STL export (THIS MODIFIES DESIGN)
-        utils.copy_occs(root)
-        utils.export_stl(design, save_dir, components)
+        _report_progress(progress, 10, 'Copying components...')
+        exported_occs = utils.copy_occs(root, occurrences)
+
+        _report_progress(progress, 20, 'Exporting STL files...')
+        failed_stl = utils.export_stl(
+            design, save_dir, exported_occs,
+            progress=lambda i, n, name: _report_progress(
+                progress, 20 + 70 * i // n, f'Exporting STL {i + 1}/{n}: {name}'
+            )
+        )
+
+        if failed_stl:
+            msg += '\nFailed to export STL for: ' + ', '.join(failed_stl)
 
         # --------------------
         # Unity URDF
+        _report_progress(progress, 90, 'Generating Unity URDF...')
+        # imported here: only this step needs it, and importing it patches
+        # xml.dom.minidom for the whole Fusion Python session
+        from .utils.xacro2unity import convert_xacro_to_urdf
+
         unity_dir = Path(save_dir) / f'{robot_name}_unity_urdf'
         unity_dir.mkdir(parents=True, exist_ok=True)
 
         xacro_file = os.path.join(save_dir, 'urdf', f'{robot_name}.xacro')
-        convert_xacro_to_urdf(
-            xacro_file=xacro_file,
-            output_urdf_path=str(unity_dir / f'{robot_name}.urdf')
-        )
 
         unity_package_dir = unity_dir / package_name
         unity_package_dir.mkdir(parents=True, exist_ok=True)
 
         src_meshes = Path(save_dir) / 'meshes'
         dst_meshes = unity_package_dir / 'meshes'
-        if src_meshes.exists():
-            shutil.copytree(src_meshes, dst_meshes, dirs_exist_ok=True)
+
+        # xacro expansion and the mesh clone are plain file work (no Fusion API),
+        # so run them side by side; result() re-raises any error for the rollback
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(
+                convert_xacro_to_urdf,
+                xacro_file=xacro_file,
+                output_urdf_path=str(unity_dir / f'{robot_name}.urdf'),
+                # the included .gazebo/.trans/materials files were just rewritten;
+                # also keeps parsed documents from piling up over the session
+                clear_cache=True
+            )]
+            if src_meshes.exists():
+                futures.append(executor.submit(utils.clone_tree, src_meshes, dst_meshes))
+            for future in futures:
+                future.result()
 
         # --------------------
         # cleanup copied components
         if cleanup_components:
+            _report_progress(progress, 95, 'Cleaning up copied components...')
             utils.cleanup_copied_components(root)
+            _cleanup_done = True
             msg += '\nCopied components cleaned up.'
 
         msg += f'\nFiles saved to:\n{save_dir}'
+        progress.hide()
         if ui:
             ui.messageBox(msg, title)
 
         # Success: do NOT rollback or delete history
         _need_rollback = False
 
+    except _ExportCanceled:
+        if ui:
+            ui.messageBox('Fusion2URDF was canceled', 'Fusion2URDF')
+        # Keep _need_rollback = True so we rollback in finally
+
     except:
         if ui:
             ui.messageBox('Failed:\n{}'.format(traceback.format_exc()))
         # Keep _need_rollback = True so we rollback in finally
 
     finally:
+        if progress is not None:
+            try:
+                progress.hide()
+            except:
+                pass
+
         # --------------------
         # On ANY failure or early-return -> rollback and truncate timeline
         try:
@@ -332,34 +450,48 @@ def run(context):
                 app = adsk.core.Application.get()
 
             if _need_rollback and design is not None:
-                # Move marker to end first (make items deletable)
-                try:
-                    _move_marker_to_end(design)
-                except:
-                    pass
-
-                # Delete all timeline items created after the script started (truncate)
-                try:
-                    if _start_timeline_count is not None:
-                        _delete_timeline_from_index_strict(design, _start_timeline_count)
-                except:
-                    if ui:
-                        ui.messageBox(
-                            'Failed to delete timeline items:\n{}'.format(traceback.format_exc()),
-                            'Fusion2URDF'
-                        )
-
-                # Optional: move marker to end again (end is now truncated)
-                try:
-                    _move_marker_to_end(design)
-                except:
-                    pass
+                if timeline is None:
+                    timeline = _TimelineView(design)
+                # The design has been modified since the start count was read
+                timeline.invalidate()
+
+                # If the copies were already removed by cleanup_copied_components,
+                # only truncate when items past the start count are still left
+                truncate = _start_timeline_count is not None
+                if truncate and _cleanup_done:
+                    try:
+                        truncate = timeline.count > _start_timeline_count
+                    except:
+                        pass
+
+                if truncate:
+                    # Move marker to end first (make items deletable)
+                    try:
+                        _move_marker_to_end(timeline)
+                    except:
+                        pass
+
+                    # Delete all timeline items created after the script started (truncate)
+                    try:
+                        _delete_timeline_from_index_strict(timeline, _start_timeline_count)
+                    except:
+                        if ui:
+                            ui.messageBox(
+                                'Failed to delete timeline items:\n{}'.format(traceback.format_exc()),
+                                'Fusion2URDF'
+                            )
+
+                    # Optional: move marker to end again (end is now truncated)
+                    try:
+                        _move_marker_to_end(timeline)
+                    except:
+                        pass
 
                 # Optional: also move marker back to the original start marker for "start state" viewing
                 # If you prefer to visually show the start state, uncomment below:
                 # try:
                 #     if _start_marker_index is not None:
-                #         _try_set_timeline_marker(design, _start_marker_index)
+                #         _try_set_timeline_marker(timeline, _start_marker_index)
                 # except:
                 #     pass
 
@@ -5,10 +5,11 @@ Created on Sun May 12 20:17:17 2019
 @author: syuntoku
 """
 
-import adsk, re
-from xml.etree.ElementTree import Element, SubElement
+import adsk
 from ..utils import utils
 
+_attr = utils.xml_attr
+
 
 class Joint:
     def __init__(self, name, xyz, axis, parent, child, joint_type, upper_limit, lower_limit):
@@ -24,76 +25,143 @@ class Joint:
         self.lower_limit = lower_limit
 
     def make_joint_xml(self):
-        joint = Element('joint')
-        joint.attrib = {'name': self.name, 'type': self.type}
-
-        origin = SubElement(joint, 'origin')
-        origin.attrib = {
-            'xyz': ' '.join([str(_) for _ in self.xyz]),
-            'rpy': '0 0 0'
-        }
-
-        parent = SubElement(joint, 'parent')
-        parent.attrib = {'link': self.parent}
-
-        child = SubElement(joint, 'child')
-        child.attrib = {'link': self.child}
+        """
+        Generate the joint_xml and hold it by self.joint_xml
+
+        The layout matches what utils.prettify produced for the same element
+        (sorted attributes, two-space indent) without the XML round-trip.
+        """
+        lines = [
+            f'<joint name="{_attr(self.name)}" type="{_attr(self.type)}">',
+            f'  <origin rpy="0 0 0" xyz="{_attr(" ".join([str(_) for _ in self.xyz]))}"/>',
+            f'  <parent link="{_attr(self.parent)}"/>',
+            f'  <child link="{_attr(self.child)}"/>',
+        ]
 
         if self.type in ['revolute', 'continuous', 'prismatic']:
-            axis = SubElement(joint, 'axis')
-            axis.attrib = {'xyz': ' '.join([str(_) for _ in self.axis])}
+            lines.append(f'  <axis xyz="{_attr(" ".join([str(_) for _ in self.axis]))}"/>')
 
         if self.type in ['revolute', 'prismatic']:
-            limit = SubElement(joint, 'limit')
-            limit.attrib = {
-                'upper': str(self.upper_limit),
-                'lower': str(self.lower_limit),
-                'effort': '100',
-                'velocity': '100'
-            }
+            lines.append(
+                f'  <limit effort="100" lower="{_attr(self.lower_limit)}" '
+                f'upper="{_attr(self.upper_limit)}" velocity="100"/>'
+            )
 
-        self.joint_xml = "\n".join(utils.prettify(joint).split("\n")[1:])
+        lines.append('</joint>')
+        self.joint_xml = "\n".join(lines) + "\n"
 
     def make_transmission_xml(self):
-        tran = Element('transmission')
-        tran.attrib = {'name': self.name + '_tran'}
-
-        joint_type = SubElement(tran, 'type')
-        joint_type.text = 'transmission_interface/SimpleTransmission'
+        """
+        Generate the tran_xml and hold it by self.tran_xml
+        """
+        name = _attr(self.name)
+        self.tran_xml = (
+            f'<transmission name="{name}_tran">\n'
+            '  <type>transmission_interface/SimpleTransmission</type>\n'
+            f'  <joint name="{name}">\n'
+            '    <hardwareInterface>hardware_interface/EffortJointInterface</hardwareInterface>\n'
+            '  </joint>\n'
+            f'  <actuator name="{name}_actr">\n'
+            '    <hardwareInterface>hardware_interface/EffortJointInterface</hardwareInterface>\n'
+            '    <mechanicalReduction>1</mechanicalReduction>\n'
+            '  </actuator>\n'
+            '</transmission>\n'
+        )
+
+
+def _trans(M, a):
+    """
+    apply the 4x4 row-major transform M (Matrix3D.asArray()) to the point a
+    """
+    return [
+        a[0]*M[0] + a[1]*M[1] + a[2]*M[2] + M[3],
+        a[0]*M[4] + a[1]*M[5] + a[2]*M[6] + M[7],
+        a[0]*M[8] + a[1]*M[9] + a[2]*M[10] + M[11],
+    ]
 
-        joint = SubElement(tran, 'joint')
-        joint.attrib = {'name': self.name}
-        hw_joint = SubElement(joint, 'hardwareInterface')
-        hw_joint.text = 'hardware_interface/EffortJointInterface'
 
-        actuator = SubElement(tran, 'actuator')
-        actuator.attrib = {'name': self.name + '_actr'}
-        hw_act = SubElement(actuator, 'hardwareInterface')
-        hw_act.text = 'hardware_interface/EffortJointInterface'
+def _allclose(v1, v2, tol=1e-6):
+    return not any(abs(a - b) >= tol for a, b in zip(v1, v2))
 
-        reduction = SubElement(actuator, 'mechanicalReduction')
-        reduction.text = '1'
 
-        self.tran_xml = "\n".join(utils.prettify(tran).split("\n")[1:])
+# Fusion's JointTypes enum value -> exported joint type
+_JOINT_TYPE_NAMES = (
+    'fixed', 'revolute', 'prismatic',
+    'Cylinderical', 'PinSlot', 'Planner', 'Ball'
+)
 
 
-def make_joints_dict(root, msg):
+def _handle_revolute(motion, joint_dict, name):
+    """
+    fill axis and limits of a revolute joint, return an error message or None
+    """
+    joint_dict['axis'] = [
+        round(i, 6)
+        for i in motion.rotationAxisVector.asArray()
+    ]
 
-    joint_type_list = [
-        'fixed', 'revolute', 'prismatic',
-        'Cylinderical', 'PinSlot', 'Planner', 'Ball'
+    rot_limits = motion.rotationLimits
+    max_enabled = rot_limits.isMaximumValueEnabled
+    min_enabled = rot_limits.isMinimumValueEnabled
+
+    if max_enabled and min_enabled:
+        joint_dict['upper_limit'] = round(rot_limits.maximumValue, 6)
+        joint_dict['lower_limit'] = round(rot_limits.minimumValue, 6)
+    elif max_enabled:
+        return name + ' is missing lower limit.'
+    elif min_enabled:
+        return name + ' is missing upper limit.'
+    else:
+        joint_dict['type'] = 'continuous'
+    return None
+
+
+def _handle_prismatic(motion, joint_dict, name):
+    """
+    fill axis and limits of a prismatic joint, return an error message or None
+    """
+    joint_dict['axis'] = [
+        round(i, 6)
+        for i in motion.slideDirectionVector.asArray()
     ]
 
+    slide_limits = motion.slideLimits
+    max_enabled = slide_limits.isMaximumValueEnabled
+    min_enabled = slide_limits.isMinimumValueEnabled
+
+    if max_enabled and min_enabled:
+        joint_dict['upper_limit'] = round(slide_limits.maximumValue / 100, 6)
+        joint_dict['lower_limit'] = round(slide_limits.minimumValue / 100, 6)
+    elif max_enabled:
+        return name + ' is missing lower limit.'
+    elif min_enabled:
+        return name + ' is missing upper limit.'
+    return None
+
+
+# joint types that carry an axis and limits; the others keep the defaults
+_JOINT_HANDLERS = {
+    1: _handle_revolute,
+    2: _handle_prismatic,
+}
+
+
+def make_joints_dict(root, msg):
+
     joints_dict = {}
 
     for joint in root.joints:
         joint_dict = {}
+        # every attribute read crosses the Fusion API, so read each one once
+        name = joint.name
 
         # ---- joint type ----
         try:
-            joint_type = joint_type_list[joint.jointMotion.jointType]
+            motion = joint.jointMotion
+            type_id = motion.jointType
+            joint_type = _JOINT_TYPE_NAMES[type_id]
         except:
-            msg = f'Unsupported joint type: "{joint.name}"'
+            msg = f'Unsupported joint type: "{name}"'
             break
 
         joint_dict['type'] = joint_type
@@ -101,54 +169,20 @@ def make_joints_dict(root, msg):
         joint_dict['upper_limit'] = 0.0
         joint_dict['lower_limit'] = 0.0
 
-        # ---- revolute ----
-        if joint_type == 'revolute':
-            joint_dict['axis'] = [
-                round(i, 6)
-                for i in joint.jointMotion.rotationAxisVector.asArray()
-            ]
-
-            rot_limits = joint.jointMotion.rotationLimits
-            max_enabled = rot_limits.isMaximumValueEnabled
-            min_enabled = rot_limits.isMinimumValueEnabled
-
-            if max_enabled and min_enabled:
-                joint_dict['upper_limit'] = round(rot_limits.maximumValue, 6)
-                joint_dict['lower_limit'] = round(rot_limits.minimumValue, 6)
-            elif max_enabled:
-                msg = joint.name + ' is missing lower limit.'
-                break
-            elif min_enabled:
-                msg = joint.name + ' is missing upper limit.'
-                break
-            else:
-                joint_dict['type'] = 'continuous'
-
-        # ---- prismatic ----
-        elif joint_type == 'prismatic':
-            joint_dict['axis'] = [
-                round(i, 6)
-                for i in joint.jointMotion.slideDirectionVector.asArray()
-            ]
-
-            slide_limits = joint.jointMotion.slideLimits
-            max_enabled = slide_limits.isMaximumValueEnabled
-            min_enabled = slide_limits.isMinimumValueEnabled
-
-            if max_enabled and min_enabled:
-                joint_dict['upper_limit'] = round(slide_limits.maximumValue / 100, 6)
-                joint_dict['lower_limit'] = round(slide_limits.minimumValue / 100, 6)
-            elif max_enabled:
-                msg = joint.name + ' is missing lower limit.'
-                break
-            elif min_enabled:
-                msg = joint.name + ' is missing upper limit.'
+        # ---- axis / limits ----
+        handler = _JOINT_HANDLERS.get(type_id)
+        if handler is not None:
+            error = handler(motion, joint_dict, name)
+            if error:
+                msg = error
                 break
 
         # ---- SAFETY CHECK (CRITICAL) ----
-        if joint.occurrenceOne is None or joint.occurrenceTwo is None:
+        occ1 = joint.occurrenceOne
+        occ2 = joint.occurrenceTwo
+        if occ1 is None or occ2 is None:
             msg = (
-                f'Invalid joint detected: "{joint.name}"\n\n'
+                f'Invalid joint detected: "{name}"\n\n'
                 'This joint is detected by Fusion API but is not fully visible in the UI.\n'
                 'It is likely a residual joint created by design history '
                 '(e.g. Rigid / As-Built Joint) that was deleted or hidden later.\n\n'
@@ -162,52 +196,41 @@ def make_joints_dict(root, msg):
             break
 
         # ---- parent / child ----
-        if joint.occurrenceTwo.component.name == 'base_link':
+        if occ2.component.name == 'base_link':
             joint_dict['parent'] = 'base_link'
         else:
-            joint_dict['parent'] = re.sub('[ :()]', '_', joint.occurrenceTwo.name)
-
-        joint_dict['child'] = re.sub('[ :()]', '_', joint.occurrenceOne.name)
+            joint_dict['parent'] = utils.sanitize_name(occ2.name)
 
-        # ---- transform helpers ----
-        def trans(M, a):
-            ex = [M[0], M[4], M[8]]
-            ey = [M[1], M[5], M[9]]
-            ez = [M[2], M[6], M[10]]
-            oo = [M[3], M[7], M[11]]
-            return [
-                a[0]*ex[i] + a[1]*ey[i] + a[2]*ez[i] + oo[i]
-                for i in range(3)
-            ]
-
-        def allclose(v1, v2, tol=1e-6):
-            return max(abs(a - b) for a, b in zip(v1, v2)) < tol
+        joint_dict['child'] = utils.sanitize_name(occ1.name)
 
         # ---- joint origin ----
         try:
-            xyz_from_one = joint.geometryOrOriginOne.origin.asArray()
-            xyz_from_two = joint.geometryOrOriginTwo.origin.asArray()
-            xyz_of_one = joint.occurrenceOne.transform.translation.asArray()
-            M_two = joint.occurrenceTwo.transform.asArray()
-
-            if allclose(xyz_from_two, xyz_from_one) or allclose(xyz_from_two, xyz_of_one):
+            g1 = joint.geometryOrOriginOne
+            g2 = joint.geometryOrOriginTwo
+            xyz_from_one = g1.origin.asArray()
+            xyz_from_two = g2.origin.asArray()
+            xyz_of_one = occ1.transform.translation.asArray()
+            M_two = occ2.transform.asArray()
+
+            if _allclose(xyz_from_two, xyz_from_one) or _allclose(xyz_from_two, xyz_of_one):
                 xyz_joint = xyz_from_two
             else:
-                xyz_joint = trans(M_two, xyz_from_two)
+                xyz_joint = _trans(M_two, xyz_from_two)
 
             joint_dict['xyz'] = [round(i / 100.0, 6) for i in xyz_joint]
 
         except:
             try:
-                if isinstance(joint.geometryOrOriginTwo, adsk.fusion.JointOrigin):
-                    data = joint.geometryOrOriginTwo.geometry.origin.asArray()
+                g2 = joint.geometryOrOriginTwo
+                if isinstance(g2, adsk.fusion.JointOrigin):
+                    data = g2.geometry.origin.asArray()
                 else:
-                    data = joint.geometryOrOriginTwo.origin.asArray()
+                    data = g2.origin.asArray()
                 joint_dict['xyz'] = [round(i / 100.0, 6) for i in data]
             except:
-                msg = joint.name + " doesn't have a valid joint origin."
+                msg = name + " doesn't have a valid joint origin."
                 break
 
-        joints_dict[joint.name] = joint_dict
+        joints_dict[name] = joint_dict
 
     return joints_dict, msg
@@ -5,10 +5,11 @@ Created on Sun May 12 20:11:28 2019
 @author: syuntoku
 """
 
-import adsk, re
-from xml.etree.ElementTree import Element, SubElement
+import adsk
 from ..utils import utils
 
+_attr = utils.xml_attr
+
 class Link:
 
     def __init__(self, name, xyz, center_of_mass, repo, mass, inertia_tensor):
@@ -43,46 +44,45 @@ class Link:
     def make_link_xml(self):
         """
         Generate the link_xml and hold it by self.link_xml
+
+        The layout matches what utils.prettify produced for the same element
+        (sorted attributes, two-space indent) without building the tree.
         """
         
-        link = Element('link')
-        link.attrib = {'name':self.name}
-        
-        #inertial
-        inertial = SubElement(link, 'inertial')
-        origin_i = SubElement(inertial, 'origin')
-        origin_i.attrib = {'xyz':' '.join([str(_) for _ in self.center_of_mass]), 'rpy':'0 0 0'}       
-        mass = SubElement(inertial, 'mass')
-        mass.attrib = {'value':str(self.mass)}
-        inertia = SubElement(inertial, 'inertia')
-        inertia.attrib = \
-            {'ixx':str(self.inertia_tensor[0]), 'iyy':str(self.inertia_tensor[1]),\
-            'izz':str(self.inertia_tensor[2]), 'ixy':str(self.inertia_tensor[3]),\
-            'iyz':str(self.inertia_tensor[4]), 'ixz':str(self.inertia_tensor[5])}        
-        
-        # visual
-        visual = SubElement(link, 'visual')
-        origin_v = SubElement(visual, 'origin')
-        origin_v.attrib = {'xyz':' '.join([str(_) for _ in self.xyz]), 'rpy':'0 0 0'}
-        geometry_v = SubElement(visual, 'geometry')
-        mesh_v = SubElement(geometry_v, 'mesh')
-        mesh_v.attrib = {'filename':self.repo + self.name + '.stl','scale':'0.001 0.001 0.001'}
-        material = SubElement(visual, 'material')
-        material.attrib = {'name':'silver'}
-        
-        # collision
-        collision = SubElement(link, 'collision')
-        origin_c = SubElement(collision, 'origin')
-        origin_c.attrib = {'xyz':' '.join([str(_) for _ in self.xyz]), 'rpy':'0 0 0'}
-        geometry_c = SubElement(collision, 'geometry')
-        mesh_c = SubElement(geometry_c, 'mesh')
-        mesh_c.attrib = {'filename':self.repo + self.name + '.stl','scale':'0.001 0.001 0.001'}
+        name = _attr(self.name)
+        com = _attr(' '.join([str(_) for _ in self.center_of_mass]))
+        xyz = _attr(' '.join([str(_) for _ in self.xyz]))
+        ixx, iyy, izz, ixy, iyz, ixz = [_attr(_) for _ in self.inertia_tensor]
+        # the same mesh is used for visual and collision
+        mesh = (f'<mesh filename="{_attr(self.repo + self.name + ".stl")}" '
+                'scale="0.001 0.001 0.001"/>')
 
-        # print("\n".join(utils.prettify(link).split("\n")[1:]))
-        self.link_xml = "\n".join(utils.prettify(link).split("\n")[1:])
+        self.link_xml = (
+            f'<link name="{name}">\n'
+            '  <inertial>\n'
+            f'    <origin rpy="0 0 0" xyz="{com}"/>\n'
+            f'    <mass value="{_attr(self.mass)}"/>\n'
+            f'    <inertia ixx="{ixx}" ixy="{ixy}" ixz="{ixz}" '
+            f'iyy="{iyy}" iyz="{iyz}" izz="{izz}"/>\n'
+            '  </inertial>\n'
+            '  <visual>\n'
+            f'    <origin rpy="0 0 0" xyz="{xyz}"/>\n'
+            '    <geometry>\n'
+            f'      {mesh}\n'
+            '    </geometry>\n'
+            '    <material name="silver"/>\n'
+            '  </visual>\n'
+            '  <collision>\n'
+            f'    <origin rpy="0 0 0" xyz="{xyz}"/>\n'
+            '    <geometry>\n'
+            f'      {mesh}\n'
+            '    </geometry>\n'
+            '  </collision>\n'
+            '</link>\n'
+        )
 
 
-def make_inertial_dict(root, msg):
+def make_inertial_dict(root, msg, occurrences=None):
     """      
     Parameters
     ----------
@@ -90,6 +90,8 @@ def make_inertial_dict(root, msg):
         Root component
     msg: str
         Tell the status
+    occurrences: list
+        snapshot from utils.get_occurrences(root), taken when omitted
         
     Returns
     ----------
@@ -99,15 +101,17 @@ def make_inertial_dict(root, msg):
         Tell the status
     """
     # Get component properties.      
-    allOccs = root.occurrences
+    if occurrences is None:
+        occurrences = utils.get_occurrences(root)
     inertial_dict = {}
     
-    for occs in allOccs:
+    for occs in occurrences:
         # Skip the root component.
         occs_dict = {}
         prop = occs.getPhysicalProperties(adsk.fusion.CalculationAccuracy.VeryHighCalculationAccuracy)
         
-        occs_dict['name'] = re.sub('[ :()]', '_', occs.name)
+        name = utils.sanitize_name(occs.name)
+        occs_dict['name'] = name
 
         mass = prop.mass  # kg
         occs_dict['mass'] = mass
@@ -122,6 +126,6 @@ def make_inertial_dict(root, msg):
         if occs.component.name == 'base_link':
             inertial_dict['base_link'] = occs_dict
         else:
-            inertial_dict[re.sub('[ :()]', '_', occs.name)] = occs_dict
+            inertial_dict[name] = occs_dict
 
     return inertial_dict, msg
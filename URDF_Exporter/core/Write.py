@@ -6,13 +6,14 @@ Created on Sun May 12 20:46:26 2019
 """
 
 import adsk, os
+from pathlib import Path
 from xml.etree.ElementTree import Element, SubElement
 from . import Link, Joint
 from ..utils import utils
 
-def write_link_urdf(joints_dict, repo, links_xyz_dict, file_name, inertial_dict):
+def write_link_urdf(joints_dict, repo, links_xyz_dict, f, inertial_dict):
     """
-    Write links information into urdf "repo/file_name"
+    Write links information into the urdf opened as "f"
     
     
     Parameters
@@ -23,8 +24,8 @@ def write_link_urdf(joints_dict, repo, links_xyz_dict, file_name, inertial_dict)
         the name of the repository to save the xml file
     links_xyz_dict: vacant dict
         xyz information of the each link
-    file_name: str
-        urdf full path
+    f: file object
+        urdf opened for writing
     inertial_dict:
         information of the each inertial
     
@@ -33,36 +34,35 @@ def write_link_urdf(joints_dict, repo, links_xyz_dict, file_name, inertial_dict)
     In this function, links_xyz_dict is set for write_joint_tran_urdf.
     The origin of the coordinate of center_of_mass is the coordinate of the link
     """
-    with open(file_name, mode='a') as f:
-        # for base_link
-        center_of_mass = inertial_dict['base_link']['center_of_mass']
-        link = Link.Link(name='base_link', xyz=[0,0,0], 
-            center_of_mass=center_of_mass, repo=repo,
-            mass=inertial_dict['base_link']['mass'],
-            inertia_tensor=inertial_dict['base_link']['inertia'])
-        links_xyz_dict[link.name] = link.xyz
+    # for base_link
+    center_of_mass = inertial_dict['base_link']['center_of_mass']
+    link = Link.Link(name='base_link', xyz=[0,0,0], 
+        center_of_mass=center_of_mass, repo=repo,
+        mass=inertial_dict['base_link']['mass'],
+        inertia_tensor=inertial_dict['base_link']['inertia'])
+    links_xyz_dict[link.name] = link.xyz
+    link.make_link_xml()
+    f.write(link.link_xml)
+    f.write('\n')
+
+    # others
+    for joint in joints_dict:
+        name = joints_dict[joint]['child']
+        center_of_mass = \
+            [ i-j for i, j in zip(inertial_dict[name]['center_of_mass'], joints_dict[joint]['xyz'])]
+        link = Link.Link(name=name, xyz=joints_dict[joint]['xyz'],\
+            center_of_mass=center_of_mass,\
+            repo=repo, mass=inertial_dict[name]['mass'],\
+            inertia_tensor=inertial_dict[name]['inertia'])
+        links_xyz_dict[link.name] = link.xyz            
         link.make_link_xml()
         f.write(link.link_xml)
         f.write('\n')
 
-        # others
-        for joint in joints_dict:
-            name = joints_dict[joint]['child']
-            center_of_mass = \
-                [ i-j for i, j in zip(inertial_dict[name]['center_of_mass'], joints_dict[joint]['xyz'])]
-            link = Link.Link(name=name, xyz=joints_dict[joint]['xyz'],\
-                center_of_mass=center_of_mass,\
-                repo=repo, mass=inertial_dict[name]['mass'],\
-                inertia_tensor=inertial_dict[name]['inertia'])
-            links_xyz_dict[link.name] = link.xyz            
-            link.make_link_xml()
-            f.write(link.link_xml)
-            f.write('\n')
-
 
-def write_joint_urdf(joints_dict, repo, links_xyz_dict, file_name):
+def write_joint_urdf(joints_dict, repo, links_xyz_dict, f):
     """
-    Write joints and transmission information into urdf "repo/file_name"
+    Write joints and transmission information into the urdf opened as "f"
     
     
     Parameters
@@ -73,49 +73,47 @@ def write_joint_urdf(joints_dict, repo, links_xyz_dict, file_name):
         the name of the repository to save the xml file
     links_xyz_dict: dict
         xyz information of the each link
-    file_name: str
-        urdf full path
+    f: file object
+        urdf opened for writing
     """
     
-    with open(file_name, mode='a') as f:
-        for j in joints_dict:
-            parent = joints_dict[j]['parent']
-            child = joints_dict[j]['child']
-            joint_type = joints_dict[j]['type']
-            upper_limit = joints_dict[j]['upper_limit']
-            lower_limit = joints_dict[j]['lower_limit']
-            try:
-                xyz = [round(p-c, 6) for p, c in \
-                    zip(links_xyz_dict[parent], links_xyz_dict[child])]  # xyz = parent - child
-            except KeyError as ke:
-                app = adsk.core.Application.get()
-                ui = app.userInterface
-                ui.messageBox("There seems to be an error with the connection between\n\n%s\nand\n%s\n\nCheck \
+    for j in joints_dict:
+        parent = joints_dict[j]['parent']
+        child = joints_dict[j]['child']
+        joint_type = joints_dict[j]['type']
+        upper_limit = joints_dict[j]['upper_limit']
+        lower_limit = joints_dict[j]['lower_limit']
+        try:
+            xyz = [round(p-c, 6) for p, c in \
+                zip(links_xyz_dict[parent], links_xyz_dict[child])]  # xyz = parent - child
+        except KeyError as ke:
+            app = adsk.core.Application.get()
+            ui = app.userInterface
+            ui.messageBox("There seems to be an error with the connection between\n\n%s\nand\n%s\n\nCheck \
 whether the connections\nparent=component2=%s\nchild=component1=%s\nare correct or if you need \
 to swap component1<=>component2"
-                % (parent, child, parent, child), "Error!")
-                quit()
-                
-            joint = Joint.Joint(name=j, joint_type = joint_type, xyz=xyz, \
-            axis=joints_dict[j]['axis'], parent=parent, child=child, \
-            upper_limit=upper_limit, lower_limit=lower_limit)
-            joint.make_joint_xml()
-            joint.make_transmission_xml()
-            f.write(joint.joint_xml)
-            f.write('\n')
+            % (parent, child, parent, child), "Error!")
+            quit()
+            
+        joint = Joint.Joint(name=j, joint_type = joint_type, xyz=xyz, \
+        axis=joints_dict[j]['axis'], parent=parent, child=child, \
+        upper_limit=upper_limit, lower_limit=lower_limit)
+        joint.make_joint_xml()
+        joint.make_transmission_xml()
+        f.write(joint.joint_xml)
+        f.write('\n')
 
-def write_gazebo_endtag(file_name):
+def write_gazebo_endtag(f):
     """
     Write about gazebo_plugin and the </robot> tag at the end of the urdf
     
     
     Parameters
     ----------
-    file_name: str
-        urdf full path
+    f: file object
+        urdf opened for writing
     """
-    with open(file_name, mode='a') as f:
-        f.write('</robot>\n')
+    f.write('</robot>\n')
         
 
 def write_urdf(joints_dict, links_xyz_dict, inertial_dict, package_name, robot_name, save_dir):
@@ -126,7 +124,8 @@ def write_urdf(joints_dict, links_xyz_dict, inertial_dict, package_name, robot_n
 
     file_name = save_dir + '/urdf/' + robot_name + '.xacro'  # the name of urdf file
     repo = package_name + '/meshes/'  # the repository of binary stl files
-    with open(file_name, mode='w') as f:
+    # open the urdf once with a large buffer and stream every section into it
+    with open(file_name, mode='w', buffering=1 << 16) as f:
         f.write('<?xml version="1.0" ?>\n')
         f.write('<robot name="{}" xmlns:xacro="http://www.ros.org/wiki/xacro">\n'.format(robot_name))
         f.write('\n')
@@ -137,9 +136,9 @@ def write_urdf(joints_dict, links_xyz_dict, inertial_dict, package_name, robot_n
         f.write('<xacro:include filename="$(find {})/urdf/{}.gazebo" />'.format(package_name, robot_name))
         f.write('\n')
 
-    write_link_urdf(joints_dict, repo, links_xyz_dict, file_name, inertial_dict)
-    write_joint_urdf(joints_dict, repo, links_xyz_dict, file_name)
-    write_gazebo_endtag(file_name)
+        write_link_urdf(joints_dict, repo, links_xyz_dict, f, inertial_dict)
+        write_joint_urdf(joints_dict, repo, links_xyz_dict, f)
+        write_gazebo_endtag(f)
 
 def write_materials_xacro(joints_dict, links_xyz_dict, inertial_dict, package_name, robot_name, save_dir):
     try:
@@ -228,7 +227,7 @@ def write_gazebo_xacro(joints_dict, links_xyz_dict, inertial_dict, package_name,
         gazebo = Element('gazebo')
         plugin = SubElement(gazebo, 'plugin')
         plugin.attrib = {'name':'control', 'filename':'libgazebo_ros_control.so'}
-        gazebo_xml = "\n".join(utils.prettify(gazebo).split("\n")[1:])
+        gazebo_xml = utils.prettify(gazebo)
         f.write(gazebo_xml)
 
         # for base_link
@@ -297,7 +296,7 @@ def write_display_launch(package_name, robot_name, save_dir):
     node3 = SubElement(launch, 'node')
     node3.attrib = {'name':'rviz', 'pkg':'rviz', 'args':'-d $(arg rvizconfig)', 'type':'rviz', 'required':'true'}
 
-    launch_xml = "\n".join(utils.prettify(launch).split("\n")[1:])        
+    launch_xml = utils.prettify(launch)        
 
     file_name = save_dir + '/launch/display.launch'    
     with open(file_name, mode='w') as f:
@@ -345,7 +344,7 @@ def write_gazebo_launch(package_name, robot_name, save_dir):
 
 
     
-    launch_xml = "\n".join(utils.prettify(launch).split("\n")[1:])        
+    launch_xml = utils.prettify(launch)        
     
     file_name = save_dir + '/launch/' + 'gazebo.launch'    
     with open(file_name, mode='w') as f:
@@ -398,9 +397,9 @@ def write_control_launch(package_name, robot_name, save_dir, joints_dict):
     remap.attrib = {'from':'/joint_states',\
                     'to':'/' + robot_name + '/joint_states'}
     
-    #launch_xml  = "\n".join(utils.prettify(launch).split("\n")[1:])   
-    launch_xml  = "\n".join(utils.prettify(node_controller).split("\n")[1:])   
-    launch_xml += "\n".join(utils.prettify(node_publisher).split("\n")[1:])   
+    #launch_xml  = utils.prettify(launch)   
+    launch_xml  = utils.prettify(node_controller)   
+    launch_xml += utils.prettify(node_publisher)   
 
     file_name = save_dir + '/launch/controller.launch'    
     with open(file_name, mode='w') as f:
@@ -428,8 +427,7 @@ def write_yaml(package_name, robot_name, save_dir, joints_dict):
     joints_dict: dict
         information of the joints
     """
-    try: os.mkdir(save_dir + '/launch')
-    except: pass 
+    Path(save_dir + '/launch').mkdir(parents=True, exist_ok=True)
 
     controller_name = robot_name + '_controller'
     file_name = save_dir + '/launch/controller.yaml'
@@ -8,16 +8,50 @@ Created on Sun May 12 19:15:34 2019
 import adsk, adsk.core, adsk.fusion
 import os.path, re
 from xml.etree import ElementTree
-from xml.dom import minidom
+from xml.sax.saxutils import escape
 # from distutils.dir_util import copy_tree
-from shutil import copytree
-import fileinput
-import sys
+from pathlib import Path
+from shutil import copytree, copyfile
 
-def copy_occs(root):    
+# characters that are not allowed in URDF link/joint/file names
+_NAME_SANITIZE_RE = re.compile(r'[ :()]')
+
+
+def sanitize_name(name):
+    """
+    replace the characters that are invalid in URDF names with '_'
+    """
+    return _NAME_SANITIZE_RE.sub('_', name)
+
+
+def get_occurrences(root):
+    """
+    take a snapshot of the top-level occurrences of root
+
+    The list is taken once and shared by make_inertial_dict and copy_occs,
+    so the occurrences are only fetched from Fusion a single time.
+    """
+    # OccurrenceList is iterable, so let tuple() pull the items in one pass
+    # instead of a count lookup and an item(i) call per index
+    return tuple(root.occurrences)
+
+
+def copy_occs(root, occurrences=None):    
     """    
     duplicate all the components
     Original components keep their names, copied components are prefixed with 'exported_'
+
+    Parameters
+    ----------
+    root: adsk.fusion.Component
+        Root component
+    occurrences: list
+        snapshot from get_occurrences(root), taken when omitted
+
+    Returns
+    ----------
+    exported_occs: [adsk.fusion.Occurrence]
+        the newly created 'exported_' occurrences, to be passed to export_stl
     """    
     def copy_body(allOccs, occs):
         """    
@@ -31,25 +65,45 @@ def copy_occs(root):
         new_occs = allOccs.addNewComponent(transform)  # this create new occs
         # Name the copied component with 'exported_' prefix
         # Use the component name for base_link to avoid base_link_1 STL naming
-        occs_name = re.sub('[ :()]', '_', occs.name)
-        component_name = re.sub('[ :()]', '_', occs.component.name)
+        occs_name = sanitize_name(occs.name)
+        component_name = sanitize_name(occs.component.name)
         if component_name == 'base_link':
             new_occs.component.name = 'exported_base_link'
         else:
             new_occs.component.name = 'exported_' + occs_name
         new_occs = allOccs.item((allOccs.count-1))
         
-        for i in range(bodies.count):
-            body = bodies.item(i)
+        for body in tuple(bodies):
             body.copyToComponent(new_occs)
+        return new_occs
     
     allOccs = root.occurrences
-    copy_list = [allOccs.item(i) for i in range(allOccs.count)]
+    copy_list = occurrences if occurrences is not None else get_occurrences(root)
+    exported_occs = []
+
+    # Direct Modeling designs have no timeline. New features go in at the
+    # timeline marker (not necessarily the end), so the copies are located by
+    # where the marker was before and after the loop.
+    try:
+        timeline = root.parentDesign.timeline
+        start = timeline.markerPosition if timeline else None
+    except:
+        timeline = start = None
     
     # Copy bodies from original components (keep original names)
     for occs in copy_list:
         if occs.bRepBodies.count > 0:
-            copy_body(allOccs, occs)
+            exported_occs.append(copy_body(allOccs, occs))
+
+    # Collapse the new components and body copies into one timeline step
+    if start is not None:
+        try:
+            end = timeline.markerPosition - 1
+            if end > start:
+                timeline.timelineGroups.add(start, end)
+        except:
+            pass
+    return exported_occs
 
 
 def cleanup_copied_components(root):
@@ -57,19 +111,25 @@ def cleanup_copied_components(root):
     Remove all copied components that were created during STL export
     Keep only the original components (those without 'exported_' prefix)
     """
-    allOccs = root.occurrences
-    components_to_remove = []
-    
-    # Collect all occurrences and identify which ones are copied
-    occs_list = [allOccs.item(i) for i in range(allOccs.count)]
-    
-    for occs in occs_list:
-        comp_name = occs.component.name
-        # Remove components with 'exported_' prefix (these are the copies)
-        if comp_name.startswith('exported_'):
-            components_to_remove.append(occs)
+    # Collect the copied components (read each component name once)
+    components_to_remove = [
+        occs for occs in get_occurrences(root)
+        if occs.component.name.startswith('exported_')
+    ]
+    if not components_to_remove:
+        return
+
+    # Preferred: delete them in a single call so the design is updated once
+    try:
+        collection = adsk.core.ObjectCollection.create()
+        for occs in components_to_remove:
+            collection.add(occs)
+        if root.parentDesign.deleteEntities(collection):
+            return
+    except:
+        pass
     
-    # Remove copied components in reverse order to avoid index issues
+    # Fallback: remove copied components in reverse order to avoid index issues
     for occs in reversed(components_to_remove):
         try:
             occs.deleteMe()
@@ -77,7 +137,19 @@ def cleanup_copied_components(root):
             print(f"Failed to remove component {occs.component.name}: {str(e)}")
 
 
-def export_stl(design, save_dir, components):  
+def _export_occurrence_stl(exportMgr, occ, fileName, refinement):
+    """
+    export a single occurrence to "fileName" as a binary stl
+    """
+    # create stl exportOptions
+    stlExportOptions = exportMgr.createSTLExportOptions(occ, fileName)
+    stlExportOptions.sendToPrintUtility = False
+    stlExportOptions.isBinaryFormat = True
+    stlExportOptions.meshRefinement = refinement
+    exportMgr.execute(stlExportOptions)
+
+
+def export_stl(design, save_dir, exported_occs, refinement=None, progress=None):  
     """
     export stl files into "save_dir/"
     Export only from copied components (those with 'exported_' prefix)
@@ -87,35 +159,60 @@ def export_stl(design, save_dir, components):
     design: adsk.fusion.Design.cast(product)
     save_dir: str
         directory path to save
-    components: design.allComponents
+    exported_occs: [adsk.fusion.Occurrence]
+        the copies returned by copy_occs
+    refinement: adsk.fusion.MeshRefinementSettings
+        mesh resolution, one of .MeshRefinementLow .MeshRefinementMedium
+        .MeshRefinementHigh (default: .MeshRefinementLow, the fastest to export)
+    progress: callable(index, total, stl_name)
+        called before each file is exported; exceptions it raises are not caught
+
+    Returns
+    ----------
+    failed: [str]
+        names of the stl files that could not be exported
+
+    Note
+    ----------
+    The Fusion API must only be called from the main thread, so the
+    exports run one after another. Each component is exported a single
+    time even if it is listed through several occurrences.
     """
           
+    if refinement is None:
+        refinement = adsk.fusion.MeshRefinementSettings.MeshRefinementLow
+
     # create a single exportManager instance
     exportMgr = design.exportManager
     # get the script location
-    try: os.mkdir(save_dir + '/meshes')
-    except: pass
+    Path(save_dir + '/meshes').mkdir(parents=True, exist_ok=True)
     scriptDir = save_dir + '/meshes'  
-    # export the occurrence one by one in the component to a specified file
-    for component in components:
-        allOccus = component.allOccurrences
-        for occ in allOccus:
-            # Only export copied components (those with 'exported_' prefix)
-            if occ.component.name.startswith('exported_'):
-                try:
-                    # Remove the 'exported_' prefix when saving STL filename
-                    stl_name = occ.component.name.replace('exported_', '')
-                    print(stl_name)
-                    fileName = scriptDir + "/" + stl_name              
-                    # create stl exportOptions
-                    stlExportOptions = exportMgr.createSTLExportOptions(occ, fileName)
-                    stlExportOptions.sendToPrintUtility = False
-                    stlExportOptions.isBinaryFormat = True
-                    # options are .MeshRefinementLow .MeshRefinementMedium .MeshRefinementHigh
-                    stlExportOptions.meshRefinement = adsk.fusion.MeshRefinementSettings.MeshRefinementLow
-                    exportMgr.execute(stlExportOptions)
-                except:
-                    print('Component ' + occ.component.name + ' has something wrong.')
+
+    # one occurrence per stl file; the component name is read once per occurrence
+    tasks = {}
+    for occ in exported_occs:
+        comp_name = occ.component.name
+        # Only export copied components (those with 'exported_' prefix)
+        if comp_name.startswith('exported_') and comp_name not in tasks:
+            tasks[comp_name] = occ
+
+    # export the occurrence one by one to a specified file
+    failed = []
+    total = len(tasks)
+    for index, (comp_name, occ) in enumerate(tasks.items()):
+        # Remove the 'exported_' prefix when saving STL filename
+        stl_name = comp_name.replace('exported_', '')
+        if progress is not None:
+            progress(index, total, stl_name)
+        try:
+            print(stl_name)
+            fileName = scriptDir + "/" + stl_name              
+            _export_occurrence_stl(exportMgr, occ, fileName, refinement)
+        except Exception as e:
+            print('Component ' + comp_name + ' has something wrong: ' + str(e))
+            failed.append(stl_name)
+
+    return failed
                 
 
 def file_dialog(ui):     
@@ -157,6 +254,13 @@ def origin2center_of_mass(inertia, center_of_mass, mass):
     return [ round(i - mass*t, 6) for i, t in zip(inertia, translation_matrix)]
 
 
+def xml_attr(value):
+    """
+    Escape a value for use inside a double-quoted XML attribute
+    """
+    return escape(str(value), {'"': '&quot;'})
+
+
 def prettify(elem):
     """
     Return a pretty-printed XML string for the Element.
@@ -168,36 +272,71 @@ def prettify(elem):
     Returns
     ----------
     pretified xml : str
+
+    Attributes are written in sorted order and the layout is the one
+    minidom's toprettyxml gave, minus the XML declaration, so the result
+    can be written out as is.
     """
-    rough_string = ElementTree.tostring(elem, 'utf-8')
-    reparsed = minidom.parseString(rough_string)
-    return reparsed.toprettyxml(indent="  ")
+    for e in elem.iter():
+        e.attrib = dict(sorted(e.attrib.items()))
+    ElementTree.indent(elem, space="  ")
+    return ElementTree.tostring(elem, encoding="unicode").replace(" />", "/>") + "\n"
 
 def copy_package(save_dir, package_dir):
-    try: os.mkdir(save_dir + '/launch')
-    except: pass 
-    try: os.mkdir(save_dir + '/urdf')
-    except: pass 
+    Path(save_dir + '/launch').mkdir(parents=True, exist_ok=True)
+    Path(save_dir + '/urdf').mkdir(parents=True, exist_ok=True)
     # copy_tree(package_dir, save_dir)
-    copytree(package_dir, save_dir, dirs_exist_ok=True)
+    # plain file contents are enough for the template; skip copying permissions/timestamps
+    copytree(package_dir, save_dir, copy_function=copyfile, dirs_exist_ok=True)
+
+def clone_tree(src, dst):
+    """
+    mirror the files of "src" into "dst"
+
+    Files are hard-linked when possible so no data is copied; if linking
+    fails (other drive, unsupported filesystem) the file contents are copied instead.
+    """
+    os.makedirs(dst, exist_ok=True)
+    for entry in os.scandir(src):
+        target = os.path.join(dst, entry.name)
+        if entry.is_dir():
+            clone_tree(entry.path, target)
+            continue
+        if os.path.lexists(target):
+            # already linked by an earlier export: the STL was rewritten in place
+            if os.path.exists(target) and os.path.samefile(entry.path, target):
+                continue
+            os.remove(target)
+        try:
+            os.link(entry.path, target)
+        except OSError:
+            copyfile(entry.path, target)
+
+def _rewrite_lines(file_name, replacements):
+    """
+    replace every line matching a pattern with the given text,
+    reading and writing the file in one go
+    """
+    with open(file_name, encoding='utf-8') as f:
+        text = f.read()
+    for pattern, line in replacements:
+        text = pattern.sub(lambda _: line, text)
+    with open(file_name, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+_CMAKE_PROJECT_LINE_RE = re.compile(r'^.*project\(fusion2urdf\).*$', re.M)
+_PACKAGE_NAME_LINE_RE = re.compile(r'^.*<name>.*$', re.M)
+_PACKAGE_DESCRIPTION_LINE_RE = re.compile(r'^.*<description>.*$', re.M)
 
 def update_cmakelists(save_dir, package_name):
     file_name = save_dir + '/CMakeLists.txt'
-
-    for line in fileinput.input(file_name, inplace=True):
-        if 'project(fusion2urdf)' in line:
-            sys.stdout.write("project(" + package_name + ")\n")
-        else:
-            sys.stdout.write(line)
+    _rewrite_lines(file_name, [
+        (_CMAKE_PROJECT_LINE_RE, "project(" + package_name + ")"),
+    ])
 
 def update_package_xml(save_dir, package_name):
     file_name = save_dir + '/package.xml'
-
-    for line in fileinput.input(file_name, inplace=True):
-        if '<name>' in line:
-            sys.stdout.write("  <name>" + package_name + "</name>\n")
-        elif '<description>' in line:
-            sys.stdout.write("<description>The " + package_name + " package</description>\n")
-        else:
-            sys.stdout.write(line)
-        
+    _rewrite_lines(file_name, [
+        (_PACKAGE_NAME_LINE_RE, "  <name>" + package_name + "</name>"),
+        (_PACKAGE_DESCRIPTION_LINE_RE, "<description>The " + package_name + " package</description>"),
+    ])
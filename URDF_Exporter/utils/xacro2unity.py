@@ -1,6 +1,7 @@
 #! /usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import functools
 import os
 import sys
 import getopt
@@ -8,28 +9,32 @@ import re
 import string
 import xml.dom
 import xml.parsers.expat
+from collections import ChainMap
+from pathlib import Path
 from xml.dom.minidom import parse
 
 
 _FIND_PATTERN = re.compile(r"\$\(\s*find\s+([^\)\s]+)\s*\)")
 
 
+@functools.lru_cache(maxsize=None)
 def _find_package_dir(package_name, base_dir):
-    current = os.path.abspath(base_dir)
-    while True:
-        if os.path.basename(current) == package_name:
-            return current
-        candidate = os.path.join(current, package_name)
-        if os.path.isdir(candidate):
-            return candidate
-        parent = os.path.dirname(current)
-        if parent == current:
-            break
-        current = parent
+    # base_dir must already be absolute so equal directories share a cache entry
+    current = Path(base_dir)
+    for directory in (current, *current.parents):
+        if directory.name == package_name:
+            return str(directory)
+        candidate = directory / package_name
+        if candidate.is_dir():
+            return str(candidate)
     return None
 
 
 def _expand_find_substitutions(path_value, base_dir):
+    if "$(" not in path_value:
+        return path_value
+    base_dir = os.path.abspath(base_dir)
+
     def repl(match):
         package_name = match.group(1)
         package_dir = _find_package_dir(package_name, base_dir)
@@ -38,14 +43,6 @@ def _expand_find_substitutions(path_value, base_dir):
     return _FIND_PATTERN.sub(repl, path_value)
 
 
-def _write_data_compat(writer, data, attr=None):
-    try:
-        # Python 3.12+
-        return xml.dom.minidom._write_data(writer, data, attr)
-    except TypeError:
-        # Python <= 3.11
-        return xml.dom.minidom._write_data(writer, data)
-
 # =============================================================================
 # Exceptions
 # =============================================================================
@@ -60,33 +57,39 @@ class XacroException(Exception):
 def isnumber(x):
     return hasattr(x, '__int__')
 
+def _escape_attr(value):
+    # the escaping minidom's _write_data applied to attribute values
+    return value.replace("&", "&amp;").replace("<", "&lt;"). \
+        replace("\"", "&quot;").replace(">", "&gt;")
+
 # Better pretty printing of xml
 def fixed_writexml(self, writer, indent="", addindent="", newl=""):
-    writer.write(indent + "<" + self.tagName)
-
+    # The start tag is assembled and written in one call instead of four
+    # writes per attribute.
     attrs = self._get_attributes()
-    a_names = sorted(attrs.keys())
-
-    for a_name in a_names:
-        writer.write(f' {a_name}="')
-        _write_data_compat(writer, attrs[a_name].value, None)
-        writer.write('"')
-
-    if self.childNodes:
-        if len(self.childNodes) == 1 and \
-           self.childNodes[0].nodeType == xml.dom.minidom.Node.TEXT_NODE:
-            writer.write(">")
-            self.childNodes[0].writexml(writer, "", "", "")
+    tag = [indent, "<", self.tagName]
+    for a_name in sorted(attrs.keys()):
+        tag.append(f' {a_name}="{_escape_attr(attrs[a_name].value)}"')
+
+    children = self.childNodes
+    if children:
+        if len(children) == 1 and children[0].nodeType == xml.dom.minidom.Node.TEXT_NODE:
+            tag.append(">")
+            writer.write("".join(tag))
+            children[0].writexml(writer, "", "", "")
             writer.write(f"</{self.tagName}>{newl}")
             return
 
-        writer.write(f">{newl}")
-        for node in self.childNodes:
+        tag.append(">" + newl)
+        writer.write("".join(tag))
+        child_indent = indent + addindent
+        for node in children:
             if node.nodeType != xml.dom.minidom.Node.TEXT_NODE:
-                node.writexml(writer, indent + addindent, addindent, newl)
+                node.writexml(writer, child_indent, addindent, newl)
         writer.write(f"{indent}</{self.tagName}>{newl}")
     else:
-        writer.write(f"/>{newl}")
+        tag.append("/>" + newl)
+        writer.write("".join(tag))
 
 xml.dom.minidom.Element.writexml = fixed_writexml
 
@@ -98,91 +101,58 @@ class Table:
     def __init__(self, parent=None):
         self.parent = parent
         self.table = {}
+        # Own scope first, then every enclosing scope, flattened so lookups
+        # walk one list instead of recursing through the parents.
+        self.maps = [self.table] + (parent.maps if parent else [])
+        self._chain = ChainMap(*self.maps)
 
     def __getitem__(self, key):
-        if key in self.table:
+        # Most lookups hit the innermost scope (grab_properties builds a single
+        # one), so try the plain dict before going through the ChainMap.
+        try:
             return self.table[key]
-        if self.parent:
-            return self.parent[key]
-        raise KeyError(key)
+        except KeyError:
+            return self._chain[key]
 
     def __setitem__(self, key, value):
         self.table[key] = value
 
     def __contains__(self, key):
-        return key in self.table or (self.parent and key in self.parent)
+        return key in self._chain
 
 # =============================================================================
 # Lexer
 # =============================================================================
 
-class QuickLexer:
-    def __init__(self, **res):
-        self.str = ""
-        self.top = None
-        self.res = []
-        for k, v in res.items():
-            setattr(self, k, len(self.res))
-            self.res.append(v)
-
-    def lex(self, s):
-        self.str = s
-        self.top = None
-        self.next()
-
-    def peek(self):
-        return self.top
-
-    def next(self):
-        result = self.top
-        self.top = None
-        for i, r in enumerate(self.res):
-            m = re.match(r, self.str)
-            if m:
-                self.top = (i, m.group(0))
-                self.str = self.str[m.end():]
-                break
-        return result
+# Token specs in match order. Each one is compiled once, at import, into a
+# single alternation of named groups; a match's lastgroup is the token kind.
+_TEXT_TOKENS = dict(
+    EXPR=r"\$\{[^\}]*\}",
+    TEXT=r"([^\$]|\$[^{])+",
+)
 
-# =============================================================================
-# XML traversal helpers
-# =============================================================================
+_EXPR_TOKENS = dict(
+    IGNORE=r"\s+",
+    NUMBER=r"(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?",
+    SYMBOL=r"[a-zA-Z_]\w*",
+    OP=r"[\+\-\*/]",
+    LPAREN=r"\(",
+    RPAREN=r"\)",
+)
 
-def first_child_element(elt):
-    c = elt.firstChild
-    while c:
-        if c.nodeType == xml.dom.Node.ELEMENT_NODE:
-            return c
-        c = c.nextSibling
-    return None
+def _compile_tokens(spec):
+    return re.compile("|".join(f"(?P<{name}>{r})" for name, r in spec.items()))
 
-def next_sibling_element(elt):
-    c = elt.nextSibling
-    while c:
-        if c.nodeType == xml.dom.Node.ELEMENT_NODE:
-            return c
-        c = c.nextSibling
-    return None
+# Literal text and ${...} expressions, matched back to back from the start of
+# the string; scanning stops at the first position neither pattern matches.
+_TEXT_TOKEN_RE = _compile_tokens(_TEXT_TOKENS)
 
-def next_element(elt):
-    child = first_child_element(elt)
-    if child:
-        return child
-    while elt:
-        nxt = next_sibling_element(elt)
-        if nxt:
-            return nxt
-        elt = elt.parentNode
-    return None
+# Tokens of the expression inside ${...}
+_EXPR_TOKEN_RE = _compile_tokens(_EXPR_TOKENS)
 
-def next_node(node):
-    if node.firstChild:
-        return node.firstChild
-    while node:
-        if node.nextSibling:
-            return node.nextSibling
-        node = node.parentNode
-    return None
+# =============================================================================
+# XML traversal helpers
+# =============================================================================
 
 def child_elements(elt):
     c = elt.firstChild
@@ -195,75 +165,178 @@ def child_elements(elt):
 # Xacro core
 # =============================================================================
 
-all_includes = []
-
-def process_includes(doc, base_dir):
-    namespaces = {}
-    previous = doc.documentElement
-    elt = next_element(previous)
-
-    while elt:
-        if elt.tagName in ("include", "xacro:include"):
-            filename = eval_text(elt.getAttribute("filename"), {})
-            filename = _expand_find_substitutions(filename, base_dir)
-            if not os.path.isabs(filename):
-                filename = os.path.join(base_dir, filename)
-
-            try:
-                with open(filename, "r", encoding="utf-8") as f:
-                    included = parse(f)
-                    all_includes.append(filename)
-            except Exception as e:
-                raise XacroException(f'Failed to include "{filename}": {e}')
-
-            for c in child_elements(included.documentElement):
-                elt.parentNode.insertBefore(c.cloneNode(True), elt)
-            elt.parentNode.removeChild(elt)
-            elt = None
-
-            for name, value in included.documentElement.attributes.items():
-                if name.startswith("xmlns:"):
-                    namespaces[name] = value
+_IO_BUFFER_SIZE = 1 << 20
+
+def _parse(path):
+    """
+    Parse an XML file into a minidom Document.
+
+    The file is handed to expat as bytes, so it decodes the text itself
+    (honouring the XML declaration) instead of receiving str chunks that
+    it has to encode back to UTF-8.
+    """
+    with open(path, "rb", buffering=_IO_BUFFER_SIZE) as f:
+        return parse(f)
+
+# realpath -> (mtime_ns, size, Document or None). A file's first include gets
+# a private parse whose children are moved over as they are; only once a file
+# is included again is a parse kept here, and every use clones out of it.
+_INCLUDE_CACHE = {}
+
+def clear_caches():
+    """Forget parsed include files and resolved package directories."""
+    _INCLUDE_CACHE.clear()
+    _find_package_dir.cache_clear()
+
+def _load_include(filename):
+    """
+    Return (document, shared); children of a shared document must be cloned.
+    """
+    key = os.path.realpath(filename)
+    st = os.stat(key)
+    cached = _INCLUDE_CACHE.get(key)
+    if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        if cached[2] is None:
+            cached = (st.st_mtime_ns, st.st_size, _parse(key))
+            _INCLUDE_CACHE[key] = cached
+        return cached[2], True
+
+    _INCLUDE_CACHE[key] = (st.st_mtime_ns, st.st_size, None)
+    return _parse(key), False
+
+_INCLUDE_TAGS = frozenset(("include", "xacro:include"))
+_MACRO_TAGS = frozenset(("macro", "xacro:macro"))
+_PROPERTY_TAGS = frozenset(("property", "xacro:property"))
+
+def _scan_elements(doc, handlers):
+    """
+    Visit the elements below the document element in document order,
+    dispatching on tagName.
+
+    A handler returns None to keep the element and descend into it, or the
+    nodes that took its place (visited next, in order). Elements a handler
+    puts on the returned removal list are detached in one batch at the end.
+    """
+    ELEMENT = xml.dom.Node.ELEMENT_NODE
+    removed = []
+    stack = list(reversed(doc.documentElement.childNodes))
+    while stack:
+        elt = stack.pop()
+        if elt.nodeType != ELEMENT:
+            continue
+        handler = handlers.get(elt.tagName)
+        replacement = handler(elt, removed) if handler else None
+        if replacement is None:
+            stack.extend(reversed(elt.childNodes))
         else:
-            previous = elt
+            stack.extend(reversed(replacement))
+    _remove_nodes(removed)
+
+def _remove_nodes(nodes):
+    """
+    Detach nodes from their parents, rebuilding each parent's child list once
+    instead of paying a list.remove() per node
+    """
+    by_parent = {}
+    for node in nodes:
+        by_parent.setdefault(id(node.parentNode), (node.parentNode, set()))[1].add(id(node))
+
+    for parent, drop in by_parent.values():
+        kept = [c for c in parent.childNodes if id(c) not in drop]
+        for c in parent.childNodes:
+            if id(c) in drop:
+                c.parentNode = c.previousSibling = c.nextSibling = None
+        parent.childNodes[:] = kept
+        prev = None
+        for c in kept:
+            c.previousSibling = prev
+            if prev is not None:
+                prev.nextSibling = c
+            prev = c
+        if prev is not None:
+            prev.nextSibling = None
+
+def _replace_node(old, new_nodes):
+    """
+    Put new_nodes where old is, splicing the parent's child list once instead
+    of an insertBefore (a list.index + list.insert) per node and a removeChild
+    """
+    parent = old.parentNode
+    children = parent.childNodes
+    i = children.index(old)
+    prev, nxt = old.previousSibling, old.nextSibling
+    children[i:i + 1] = new_nodes
+    for node in new_nodes:
+        node.parentNode = parent
+        node.previousSibling = prev
+        if prev is not None:
+            prev.nextSibling = node
+        prev = node
+    if prev is not None:
+        prev.nextSibling = nxt
+    if nxt is not None:
+        nxt.previousSibling = prev
+    old.parentNode = old.previousSibling = old.nextSibling = None
+
+def process_includes(doc, base_dir, includes_out=None):
+    """
+    Expand xacro:include elements in place. The resolved filenames are
+    appended to includes_out when a list is given.
+    """
+    namespaces = {}
 
-        elt = next_element(previous)
+    def include(elt, removed):
+        filename = eval_text(elt.getAttribute("filename"), {})
+        filename = _expand_find_substitutions(filename, base_dir)
+        if not os.path.isabs(filename):
+            filename = os.path.join(base_dir, filename)
+
+        try:
+            included, shared = _load_include(filename)
+            if includes_out is not None:
+                includes_out.append(filename)
+        except Exception as e:
+            raise XacroException(f'Failed to include "{filename}": {e}')
+
+        inserted = list(child_elements(included.documentElement))
+        if shared:
+            inserted = [c.cloneNode(True) for c in inserted]
+        _replace_node(elt, inserted)
+
+        for name, value in included.documentElement.attributes.items():
+            if name.startswith("xmlns:"):
+                namespaces[name] = value
+        return inserted
+
+    _scan_elements(doc, dict.fromkeys(_INCLUDE_TAGS, include))
 
     for k, v in namespaces.items():
         doc.documentElement.setAttribute(k, v)
 
 def grab_macros(doc):
     macros = {}
-    previous = doc.documentElement
-    elt = next_element(previous)
-
-    while elt:
-        if elt.tagName in ("macro", "xacro:macro"):
-            name = elt.getAttribute("name")
-            macros[name] = elt
-            macros["xacro:" + name] = elt
-            elt.parentNode.removeChild(elt)
-            elt = None
-        else:
-            previous = elt
-        elt = next_element(previous)
+
+    def macro(elt, removed):
+        name = elt.getAttribute("name")
+        macros[name] = elt
+        macros["xacro:" + name] = elt
+        removed.append(elt)
+        return ()
+
+    _scan_elements(doc, dict.fromkeys(_MACRO_TAGS, macro))
     return macros
 
 def grab_properties(doc):
     table = Table()
-    previous = doc.documentElement
-    elt = next_element(previous)
-
-    while elt:
-        if elt.tagName in ("property", "xacro:property"):
-            name = elt.getAttribute("name")
-            value = elt.getAttribute("value") if elt.hasAttribute("value") else elt
-            table[name] = value
-            elt.parentNode.removeChild(elt)
-            elt = None
-        else:
-            previous = elt
-        elt = next_element(previous)
+
+    def prop(elt, removed):
+        name = elt.getAttribute("name")
+        value = elt.getAttribute("value") if elt.hasAttribute("value") else elt
+        table[name] = value
+        removed.append(elt)
+        return ()
+
+    _scan_elements(doc, dict.fromkeys(_PROPERTY_TAGS, prop))
     return table
 
 # =============================================================================
@@ -271,67 +344,67 @@ def grab_properties(doc):
 # =============================================================================
 
 def eval_text(text, symbols):
-    def handle_expr(s):
-        lex = QuickLexer(
-            IGNORE=r"\s+",
-            NUMBER=r"(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?",
-            SYMBOL=r"[a-zA-Z_]\w*",
-            OP=r"[\+\-\*/]",
-            LPAREN=r"\(",
-            RPAREN=r"\)",
-        )
-        lex.lex(s)
-        return eval_expr(lex, symbols)
+    # Nothing to substitute: most attributes and text nodes end here. The test
+    # is for "$" rather than "${" because the scan below drops a trailing "$".
+    if "$" not in text:
+        return text
 
     results = []
-    lex = QuickLexer(
-        EXPR=r"\$\{[^\}]*\}",
-        TEXT=r"([^\$]|\$[^{])+"
-    )
-    lex.lex(text)
-
-    while lex.peek():
-        if lex.peek()[0] == lex.EXPR:
-            results.append(str(handle_expr(lex.next()[1][2:-1])))
+    m = _TEXT_TOKEN_RE.match(text)
+    while m:
+        if m.lastgroup == "EXPR":
+            results.append(str(eval_expr(text[m.start() + 2:m.end() - 1], symbols)))
         else:
-            results.append(lex.next()[1])
+            results.append(m.group())
+        m = _TEXT_TOKEN_RE.match(text, m.end())
 
     return "".join(results)
 
-def eval_expr(lex, symbols):
+def eval_expr(expr, symbols):
     result = 0
-    if not lex.peek():
+    m = _EXPR_TOKEN_RE.match(expr)
+    if not m:
         return result
-    if lex.peek()[0] in (lex.NUMBER, lex.SYMBOL):
-        token = lex.next()[1]
+    kind = m.lastgroup
+    if kind == "NUMBER":
+        # the NUMBER pattern only matches valid float literals
+        return float(m.group())
+    if kind == "SYMBOL":
+        value = symbols[m.group()]
+        if type(value) is float:
+            return value
         try:
-            return float(token)
-        except ValueError:
-            value = symbols[token]
-            try:
-                return float(value)
-            except (ValueError, TypeError):
-                return str(value)
+            return float(value)
+        except (ValueError, TypeError):
+            return str(value)
     return result
 
+def _eval_attributes(elt, symbols):
+    # Update the Attr nodes in place; setAttribute would look each name up and
+    # rebuild the node. The dict itself is not resized, so iterating is safe.
+    for attr in elt.attributes.values():
+        value = eval_text(attr.value, symbols)
+        if value != attr.value:
+            attr.value = value
+
 def eval_all(root, macros, symbols):
-    for at in root.attributes.items():
-        root.setAttribute(at[0], eval_text(at[1], symbols))
-
-    previous = root
-    node = next_node(previous)
-
-    while node:
-        if node.nodeType == xml.dom.Node.ELEMENT_NODE:
-            for at in node.attributes.items():
-                node.setAttribute(at[0], eval_text(at[1], symbols))
-            previous = node
-        elif node.nodeType == xml.dom.Node.TEXT_NODE:
-            node.data = eval_text(node.data, symbols)
-            previous = node
-        else:
-            previous = node
-        node = next_node(previous)
+    # bound once; the loop below runs for every node of the document
+    ELEMENT = xml.dom.Node.ELEMENT_NODE
+    TEXT = xml.dom.Node.TEXT_NODE
+    _eval_text = eval_text
+
+    stack = [root]
+    pop, extend = stack.pop, stack.extend
+    while stack:
+        node = pop()
+        node_type = node.nodeType
+        if node_type == ELEMENT:
+            _eval_attributes(node, symbols)
+            extend(reversed(node.childNodes))
+        elif node_type == TEXT:
+            data = _eval_text(node.data, symbols)
+            if data != node.data:
+                node.data = data
 
 def eval_self_contained(doc):
     macros = grab_macros(doc)
@@ -342,7 +415,15 @@ def eval_self_contained(doc):
 # Public API
 # =============================================================================
 
-def convert_xacro_to_urdf(xacro_file: str, output_urdf_path: str) -> None:
+def convert_xacro_to_urdf(xacro_file: str, output_urdf_path: str,
+                          clear_cache: bool = False) -> None:
+    """
+    Expand xacro_file into a plain URDF at output_urdf_path.
+
+    Parsed include files are kept between calls (and re-read when they
+    change on disk), so batch conversions sharing macro libraries parse
+    them once; pass clear_cache=True to start from an empty cache.
+    """
     xacro_file = os.path.abspath(xacro_file)
     output_urdf_path = os.path.abspath(output_urdf_path)
 
@@ -350,11 +431,14 @@ def convert_xacro_to_urdf(xacro_file: str, output_urdf_path: str) -> None:
         raise FileNotFoundError(xacro_file)
 
     os.makedirs(os.path.dirname(output_urdf_path), exist_ok=True)
+    if clear_cache:
+        clear_caches()
+    else:
+        # package lookups are memoized for this conversion only; folders may change between runs
+        _find_package_dir.cache_clear()
 
-    with open(xacro_file, "r", encoding="utf-8") as f:
-        doc = parse(f)
+    doc = _parse(xacro_file)
 
-    all_includes.clear()
     process_includes(doc, os.path.dirname(xacro_file))
     eval_self_contained(doc)
 
@@ -368,10 +452,35 @@ def convert_xacro_to_urdf(xacro_file: str, output_urdf_path: str) -> None:
     for c in reversed(banner):
         doc.insertBefore(c, doc.firstChild)
 
-    with open(output_urdf_path, "w", encoding="utf-8") as f:
-        f.write(doc.toprettyxml(indent="  "))
+    # stream straight into the buffered file rather than building the whole
+    # pretty-printed string first (same output as toprettyxml(indent="  "))
+    with open(output_urdf_path, "w", encoding="utf-8", buffering=_IO_BUFFER_SIZE) as f:
+        doc.writexml(f, "", "  ", "\n")
         f.write("\n")
 
+def _convert_pair(pair):
+    convert_xacro_to_urdf(*pair)
+
+def convert_many(pairs, workers=None) -> None:
+    """
+    Convert several (xacro_file, output_urdf_path) pairs, one process per
+    file up to `workers` (default: CPU count). Each worker process keeps its
+    own include cache. Not for use inside Fusion 360, where a new process
+    would be another copy of the application.
+    """
+    pairs = list(pairs)
+    if len(pairs) <= 1 or workers == 1:
+        for pair in pairs:
+            _convert_pair(pair)
+        return
+
+    # imported here: the add-in imports this module inside Fusion and never
+    # needs multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(workers) as ex:
+        list(ex.map(_convert_pair, pairs))
+
 # =============================================================================
 # CLI
 # =============================================================================
@@ -9,6 +9,7 @@ import argparse
 import os
 import shutil
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 
@@ -24,9 +25,72 @@ def get_default_target_base() -> Path:
     return Path.home() / ".local" / "share" / "Autodesk" / "Autodesk Fusion 360" / "API" / "Scripts"
 
 
+def copy_tree_parallel(source_dir: Path, target_dir: Path, workers: int = 8) -> None:
+    # Directories are created while walking; only the file copies go to the
+    # pool so their open/close latency overlaps.
+    copied_dirs = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for root, _, files in os.walk(source_dir, followlinks=True):
+            dst_root = os.path.join(target_dir, os.path.relpath(root, source_dir))
+            os.makedirs(dst_root, exist_ok=True)
+            copied_dirs.append((root, dst_root))
+            for name in files:
+                futures.append(executor.submit(shutil.copy2, os.path.join(root, name), os.path.join(dst_root, name)))
+        for future in futures:
+            future.result()
+
+    # Directory permissions and times are applied only after every file is in
+    # place (deepest first), so a read-only source directory cannot block them.
+    for src, dst in reversed(copied_dirs):
+        shutil.copystat(src, dst)
+
+
+def _error_reason(exc: OSError) -> str:
+    # copytree gathers one (src, dst, why) entry per failed file; show the first
+    if isinstance(exc, shutil.Error) and exc.args and isinstance(exc.args[0], list) and exc.args[0]:
+        return str(exc.args[0][0][2])
+    return exc.strerror or str(exc)
+
+
+def hardlink_probe(source_dir: Path, target_base: Path) -> str | None:
+    """Link one source file into target_base; return why it failed, or None."""
+    sample = next((p for p in source_dir.rglob("*") if p.is_file()), None)
+    if sample is None:
+        return None
+    probe = target_base / ".urdf_exporter_link_probe"
+    try:
+        probe.unlink(missing_ok=True)
+        os.link(sample, probe)
+    except OSError as exc:
+        return _error_reason(exc)
+    probe.unlink(missing_ok=True)
+    return None
+
+
+def install_tree(source_dir: Path, target_dir: Path, link: bool = False) -> None:
+    if link:
+        # e.g. a cross-device target or a filesystem without hardlinks
+        reason = hardlink_probe(source_dir, target_dir.parent)
+        if reason is None:
+            try:
+                shutil.copytree(source_dir, target_dir, copy_function=os.link, dirs_exist_ok=True)
+                return
+            except OSError as exc:
+                reason = _error_reason(exc)
+                shutil.rmtree(target_dir, ignore_errors=True)
+        print(f"Hardlinking failed ({reason}), copying instead.")
+    copy_tree_parallel(source_dir, target_dir)
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Install URDF_Exporter into Fusion 360 Scripts directory.")
     parser.add_argument("--force", action="store_true", help="Overwrite existing installation without prompting.")
+    parser.add_argument(
+        "--link",
+        action="store_true",
+        help="Hardlink files instead of copying them (falls back to copying across filesystems).",
+    )
     parser.add_argument(
         "--target",
         type=Path,
@@ -75,7 +139,7 @@ def main() -> int:
     try:
         print("Installing URDF_Exporter...")
         target_dir.parent.mkdir(parents=True, exist_ok=True)
-        shutil.copytree(source_dir, target_dir, dirs_exist_ok=True)
+        install_tree(source_dir, target_dir, link=args.link)
         print("URDF_Exporter installation complete!")
         print(f"Source: {source_dir}")
         print(f"Target: {target_dir}")